@@ -7,8 +7,13 @@
 import streamlit as st
 import firebase_admin
 from firebase_admin import credentials, firestore
-from datetime import datetime
+from google.api_core import exceptions
+from datetime import datetime, timezone
 import urllib.parse
+import bisect
+import re
+import threading
+import ahocorasick
 
 # Page config
 st.set_page_config(
@@ -96,22 +101,68 @@ KEYWORDS_DATABASE = {
     "Cleaning & Kitchen Supplies": ["tissue", "napkin", "detergent", "soap", "foil", "cleaner"]
 }
 
+KEYWORDS_DATABASE = {category: frozenset(keywords) for category, keywords in KEYWORDS_DATABASE.items()}
+
+CATEGORY_RANK = {category: rank for rank, category in enumerate(KEYWORDS_DATABASE)}
+
+EXACT_INDEX = {}
+for category, keywords in KEYWORDS_DATABASE.items():
+    for keyword in keywords:
+        # Keep the first category for keywords listed twice (butter, ghee)
+        EXACT_INDEX.setdefault(keyword.casefold().strip(), category)
+
+@st.cache_resource
+def build_keyword_automaton(exact_index):
+    # exact_index is part of the cache key, so editing the keywords rebuilds the automaton
+    automaton = ahocorasick.Automaton()
+    for keyword, category in exact_index.items():
+        automaton.add_word(keyword, (category, keyword))
+    automaton.make_automaton()
+    return automaton
+
+KEYWORD_AUTOMATON = build_keyword_automaton(EXACT_INDEX)
+
+def pick_category(item_lower, matches):
+    # matches: (category, keyword) automaton hits for item_lower
+    category = EXACT_INDEX.get(item_lower)
+    if category is not None:
+        return category
+    
+    # Prefer the longest keyword found, e.g. "mustard oil" over "oil"; ties go to the
+    # category listed first, so word order in the name doesn't matter
+    best = max(matches, key=lambda match: (len(match[1]), -CATEGORY_RANK[match[0]]), default=None)
+    if best is not None:
+        return best[0]
+    
+    return "Uncategorized"
+
 def categorize_item(item_name):
     if not item_name:
         return "Uncategorized"
     
-    item_lower = item_name.lower().strip()
-    
-    for category, keywords in KEYWORDS_DATABASE.items():
-        if item_lower in keywords:
-            return category
-    
-    for category, keywords in KEYWORDS_DATABASE.items():
-        for keyword in keywords:
-            if keyword in item_lower:
-                return category
-    
-    return "Uncategorized"
+    item_lower = item_name.casefold().strip()
+    return pick_category(item_lower, (match for _, match in KEYWORD_AUTOMATON.iter(item_lower)))
+
+def categorize_items(item_names):
+    names_lower = [name.casefold().strip() for name in item_names]
+    # Repeated names in a paste are scanned once
+    unique_names = list(dict.fromkeys(names_lower))
+    
+    # Scan every name in one automaton pass; keywords never contain the separator
+    starts = []
+    offset = 0
+    for name in unique_names:
+        starts.append(offset)
+        offset += len(name) + 1
+    
+    matches = [[] for _ in unique_names]
+    for end_index, match in KEYWORD_AUTOMATON.iter("\x00".join(unique_names)):
+        matches[bisect.bisect_right(starts, end_index) - 1].append(match)
+    
+    by_name = {}
+    for name, name_matches in zip(unique_names, matches):
+        by_name[name] = pick_category(name, name_matches)
+    return [by_name[name] for name in names_lower]
 
 # ============================================
 # VENDOR MANAGER
@@ -159,57 +210,230 @@ vendor_manager = VendorManager()
 # DRAFT MANAGER
 # ============================================
 
+FIRESTORE_BATCH_LIMIT = 500
+
+def migrate_legacy_items(draft_doc):
+    # Drafts saved before items moved to a subcollection keep them in an 'items' array
+    legacy_items = draft_doc.to_dict().get('items') or []
+    if len(legacy_items) == 0:
+        return True
+    
+    items_col = draft_doc.reference.collection('items')
+    batches = []
+    for start in range(0, len(legacy_items), FIRESTORE_BATCH_LIMIT - 1):
+        batch = db.batch()
+        for index, item in enumerate(legacy_items[start:start + FIRESTORE_BATCH_LIMIT - 1], start=start):
+            item = dict(item)
+            if isinstance(item.get('added_at'), str):
+                try:
+                    item['added_at'] = datetime.fromisoformat(item['added_at']).astimezone(timezone.utc)
+                except ValueError:
+                    pass
+            # Fixed ids make a retried migration overwrite instead of duplicate
+            batch.set(items_col.document(f"legacy-{index}"), item)
+        batches.append(batch)
+    
+    # Drop the array only if nobody appended to it since it was read
+    batches[-1].update(draft_doc.reference, {
+        'items': firestore.DELETE_FIELD
+    }, option=db.write_option(last_update_time=draft_doc.update_time))
+    
+    try:
+        for batch in batches:
+            batch.commit()
+    except exceptions.GoogleAPICallError:
+        # Includes FailedPrecondition when the array changed meanwhile; the next read retries
+        return False
+    return True
+
+class DraftCache:
+    def __init__(self, draft_ref):
+        self.draft_ref = draft_ref
+        self.lock = threading.Lock()
+        self.listen_lock = threading.Lock()
+        self.draft = None
+        self.items = None
+        self.watches = []
+    
+    def listen(self):
+        with self.listen_lock:
+            # Another session may have re-subscribed while this one waited
+            if len(self.watches) > 0 and all(watch.is_active for watch in self.watches):
+                return
+            for watch in self.watches:
+                watch.unsubscribe()
+            # Nothing from a dead stream can be trusted; get_draft reads until new snapshots land
+            with self.lock:
+                self.draft = None
+                self.items = None
+            self.watches = [
+                self.draft_ref.on_snapshot(self.on_draft_snapshot),
+                self.draft_ref.collection('items').order_by('added_at').on_snapshot(self.on_items_snapshot)
+            ]
+    
+    def ensure_listening(self):
+        # A watch stream that closed or failed stops delivering snapshots without telling anyone
+        if not all(watch.is_active for watch in self.watches):
+            self.listen()
+    
+    def get(self):
+        with self.lock:
+            if self.draft is None or self.items is None:
+                return None
+            draft = dict(self.draft)
+            draft['items'] = self.items
+            return draft
+    
+    def fill(self, draft, items):
+        # A snapshot may have landed while the caller was reading; keep the newer data
+        with self.lock:
+            if self.draft is None:
+                self.draft = draft
+            if self.items is None:
+                self.items = items
+    
+    def set_draft(self, draft):
+        with self.lock:
+            if self.draft is not None:
+                self.draft = draft
+    
+    def update_draft(self, fields):
+        with self.lock:
+            if self.draft is not None:
+                self.draft = {**self.draft, **fields}
+    
+    def add_items(self, new_items):
+        # Lists are replaced, never mutated, so get() can hand them out without copying
+        with self.lock:
+            if self.items is not None:
+                # The listener may already have delivered these writes
+                known_ids = set(item['id'] for item in self.items)
+                self.items = self.items + [item for item in new_items if item['id'] not in known_ids]
+    
+    def remove_items(self, item_ids):
+        with self.lock:
+            if self.items is not None:
+                self.items = [item for item in self.items if item['id'] not in item_ids]
+    
+    def on_draft_snapshot(self, doc_snapshots, changes, read_time):
+        # Runs on the Firestore listener thread, not the Streamlit script thread
+        draft = {"status": "Draft"}
+        for doc in doc_snapshots:
+            if doc.exists:
+                draft = doc.to_dict()
+                if draft.pop('items', None):
+                    # Leave the draft unset so get_draft reads it and migrates the
+                    # legacy items on the script thread, not this listener thread
+                    draft = None
+        with self.lock:
+            self.draft = draft
+    
+    def on_items_snapshot(self, doc_snapshots, changes, read_time):
+        items = []
+        for doc in doc_snapshots:
+            item = doc.to_dict()
+            item['id'] = doc.id
+            items.append(item)
+        with self.lock:
+            self.items = items
+
+@st.cache_resource
+def init_draft_cache():
+    cache = DraftCache(db.collection('drafts').document('current-draft'))
+    cache.listen()
+    return cache
+
+draft_cache = init_draft_cache()
+
 class DraftManager:
     def __init__(self):
         self.draft_ref = db.collection('drafts').document('current-draft')
+        self.items_col = self.draft_ref.collection('items')
         self.orders_ref = db.collection('orders')
     
-    def add_item(self, item_name, quantity, added_by):
-        category = categorize_item(item_name)
-        
-        item = {
+    def make_item(self, item_name, quantity, added_by, category):
+        return {
             "name": item_name.strip(),
             "quantity": quantity.strip(),
             "category": category,
             "added_by": added_by,
-            "added_at": datetime.now().isoformat()
+            "added_at": datetime.now(timezone.utc)
         }
+    
+    def append_items(self, new_items):
+        added = []
+        for start in range(0, len(new_items), FIRESTORE_BATCH_LIMIT):
+            batch = db.batch()
+            for item in new_items[start:start + FIRESTORE_BATCH_LIMIT]:
+                item_ref = self.items_col.document()
+                batch.set(item_ref, item)
+                added.append({**item, 'id': item_ref.id})
+            batch.commit()
         
-        draft_doc = self.draft_ref.get()
-        
-        if draft_doc.exists:
-            current_items = draft_doc.to_dict().get('items', [])
-            current_items.append(item)
-            self.draft_ref.update({
-                'items': current_items,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
-        else:
-            self.draft_ref.set({
-                'items': [item],
-                'status': 'Draft',
-                'created_at': firestore.SERVER_TIMESTAMP,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
+        draft_cache.add_items(added)
+        return added
+    
+    def delete_items(self, item_ids):
+        for start in range(0, len(item_ids), FIRESTORE_BATCH_LIMIT):
+            batch = db.batch()
+            for item_id in item_ids[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.delete(self.items_col.document(item_id))
+            batch.commit()
         
+        draft_cache.remove_items(set(item_ids))
+    
+    def add_item(self, item_name, quantity, added_by):
+        category = categorize_item(item_name)
+        self.append_items([self.make_item(item_name, quantity, added_by, category)])
         return category
     
+    def add_items(self, item_names, added_by):
+        new_items = [
+            self.make_item(name, "", added_by, category)
+            for name, category in zip(item_names, categorize_items(item_names))
+        ]
+        return self.append_items(new_items)
+    
     def get_draft(self):
+        draft_cache.ensure_listening()
+        draft = draft_cache.get()
+        if draft is not None:
+            return draft
+        
+        migrated = True
         draft_doc = self.draft_ref.get()
         if not draft_doc.exists:
-            return {"items": [], "status": "Draft"}
-        return draft_doc.to_dict()
+            draft = {"status": "Draft"}
+        else:
+            migrated = migrate_legacy_items(draft_doc)
+            draft = draft_doc.to_dict()
+            draft.pop('items', None)
+        
+        items = []
+        for doc in self.items_col.order_by('added_at').stream():
+            item = doc.to_dict()
+            item['id'] = doc.id
+            items.append(item)
+        
+        if not migrated:
+            # Don't cache a draft that is missing its legacy items; the next run retries
+            draft['items'] = items
+            return draft
+        
+        draft_cache.fill(draft, items)
+        return draft_cache.get()
     
     def approve_draft(self, approved_by):
         draft = self.get_draft()
         if len(draft.get('items', [])) == 0:
             return False, "Cannot approve empty draft"
         
-        self.draft_ref.update({
+        self.draft_ref.set({
             'status': 'Approved',
             'approved_by': approved_by,
             'approved_at': firestore.SERVER_TIMESTAMP
-        })
+        }, merge=True)
+        draft_cache.update_draft({'status': 'Approved', 'approved_by': approved_by})
         return True, "Draft approved successfully"
     
     def mark_as_sent(self, sent_by):
@@ -221,32 +445,30 @@ class DraftManager:
         
         self.orders_ref.add(order_data)
         
+        # Only delete what went into the order; items added meanwhile stay in the draft
+        self.delete_items([item['id'] for item in draft.get('items', [])])
+        self.reset_draft()
+        return True
+    
+    def reset_draft(self):
+        # Merge so a legacy 'items' array that is not migrated yet is never overwritten
         self.draft_ref.set({
-            'items': [],
             'status': 'Draft',
-            'created_at': firestore.SERVER_TIMESTAMP
-        })
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'approved_by': firestore.DELETE_FIELD,
+            'approved_at': firestore.DELETE_FIELD
+        }, merge=True)
+        draft_cache.set_draft({"status": "Draft"})
+    
+    def remove_item(self, item_id):
+        self.items_col.document(item_id).delete()
+        draft_cache.remove_items({item_id})
         return True
     
-    def remove_item(self, index):
-        draft = self.get_draft()
-        items = draft.get('items', [])
-        
-        if 0 <= index < len(items):
-            removed = items.pop(index)
-            self.draft_ref.update({
-                'items': items,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
-            return removed
-        return None
-    
     def clear_draft(self):
-        self.draft_ref.set({
-            'items': [],
-            'status': 'Draft',
-            'created_at': firestore.SERVER_TIMESTAMP
-        })
+        draft = self.get_draft()
+        self.delete_items([item['id'] for item in draft.get('items', [])])
+        self.reset_draft()
     
     def get_order_history(self, limit=10):
         docs = self.orders_ref.order_by('sent_at', direction=firestore.Query.DESCENDING).limit(limit).stream()
@@ -482,11 +704,35 @@ def add_items_screen():
         if cancel:
             st.session_state.current_page = "home"
             st.rerun()
+    
+    st.markdown("---")
+    
+    st.subheader("Add Several Items")
+    
+    with st.form("bulk_add_form", clear_on_submit=True):
+        bulk_text = st.text_area("Item Names", placeholder="e.g., Milk, Bread, Eggs\nOnions")
+        bulk_added_by = st.text_input("Added By", value=st.session_state.user_name, key="bulk_added_by")
+        
+        bulk_submitted = st.form_submit_button("➕ Add All", type="primary", use_container_width=True)
+        
+        if bulk_submitted:
+            item_names = [name.strip() for name in re.split(r"[,\n]", bulk_text or "") if name.strip()]
+            
+            if len(item_names) == 0:
+                st.error("❌ Please enter at least one item name")
+            else:
+                added = draft_manager.add_items(item_names, bulk_added_by)
+                uncategorized = [item['name'] for item in added if item['category'] == "Uncategorized"]
+                
+                st.success(f"✅ {len(added)} items added")
+                if len(uncategorized) > 0:
+                    st.warning(f"⚠️ Needs categorization: {', '.join(uncategorized)}")
 
 # ============================================
 # VIEW DRAFT SCREEN
 # ============================================
 
+@st.fragment
 def view_draft_screen():
     st.title("📋 Current Draft")
     
@@ -522,8 +768,6 @@ def view_draft_screen():
         
         with st.expander(f"{icon} {category} ({len(cat_items)} items)", expanded=True):
             for item in cat_items:
-                idx = items.index(item)
-                
                 col1, col2, col3 = st.columns([4, 2, 1])
                 
                 with col1:
@@ -535,9 +779,13 @@ def view_draft_screen():
                 
                 with col3:
                     if status == "Draft":
-                        if st.button("🗑️", key=f"del_{idx}"):
-                            draft_manager.remove_item(idx)
-                            st.rerun()
+                        if st.button("🗑️", key=f"del_{item['id']}"):
+                            draft_manager.remove_item(item['id'])
+                            # The sidebar's Review button is outside the fragment
+                            if len(draft_manager.get_draft().get('items', [])) == 0:
+                                st.rerun()
+                            else:
+                                st.rerun(scope="fragment")
                 
                 st.markdown("---")
     
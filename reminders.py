@@ -12,6 +12,11 @@ def send_reminder():
 
 schedule.every().day.at("18:00").do(send_reminder)
 
+# Sleep until the next scheduled job instead of waking up every minute
 while True:
+    idle = schedule.idle_seconds()
+    if idle is None:
+        break
+    if idle > 0:
+        time.sleep(idle)
     schedule.run_pending()
-    time.sleep(60)
\ No newline at end of file